@@ -1,10 +1,16 @@
 import argparse
+import ctypes
 import random
+import selectors
 import socket
 import struct
+import sys
 import time
 
-import select
+_PAYLOAD_256 = bytes(range(256))
+_ICMP_HDR = struct.Struct('!BBHHH')  # type, code, checksum, id, sequence
+_U16 = struct.Struct('!H')
+_SO_ATTACH_FILTER = getattr(socket, 'SO_ATTACH_FILTER', 26)  # Not exported by the socket module
 
 
 def checksum(source_string):
@@ -12,63 +18,136 @@ def checksum(source_string):
         Generates a checksum for a given string (used for packet validation).
 
         Args:
-            source_string (bytes): The data for which the checksum is to be generated.
+            source_string (bytes-like): The data for which the checksum is to be generated (bytes, bytearray or memoryview).
 
         Returns:
             int: The checksum value for the given data.
         """
-    count = len(source_string) % 2
-    sum = 0
-    for i in range(0, len(source_string) - count, 2):
-        sum += (source_string[i] << 8) + (source_string[i + 1])
-    if count:
-        sum += source_string[i + 1]
-    while sum >> 16:
-        sum = (sum >> 16) + (sum & 0xFFFF)
-    sum = ~sum & 0xFFFF
-    return sum
-
-
-def create_packet(id, data_size):
+    total = int.from_bytes(source_string, 'big')
+    if len(source_string) & 1:
+        total <<= 8  # Pad odd lengths with a zero byte
+    # 2**16 == 1 (mod 0xFFFF), so one modulo folds every 16-bit word and carry at once
+    if total:
+        total = (total - 1) % 0xFFFF + 1
+    return ~total & 0xFFFF
+
+
+def create_packet(id, data_size, sequence=1):
     """
             Given packet_id and a desired packet size created a ICMP Echo packet
 
             Args:
                 id (int): The packet ID / Number
                 data_size: The amount of bytes to pack into the packet
+                sequence (int) (default 1): The ICMP sequence number
+
+            Returns:
+                Packet: A ICMP Echo Packet of ID id of size data_size, as a mutable bytearray
+            """
+    packet = bytearray(8 + data_size)  # Header and data are written into this one buffer in place
+    _ICMP_HDR.pack_into(packet, 0, 8, 0, 0, id, sequence)
+    for offset in range(0, data_size, 256):  # Repeating 0x00..0xFF pattern
+        chunk = min(256, data_size - offset)
+        packet[8 + offset:8 + offset + chunk] = _PAYLOAD_256[:chunk]
+    _U16.pack_into(packet, 2, checksum(packet))
+    return packet
+
+
+def set_sequence(packet, sequence):
+    """
+            Rewrites the sequence number of an ICMP Echo packet in place, updating the checksum
+            incrementally (RFC 1624) instead of summing the whole packet again
+
+            Args:
+                packet (bytearray): A packet built by create_packet
+                sequence (int): The new ICMP sequence number
+
+            Returns:
+                None
+            """
+    _, _, old_checksum, _, old_sequence = _ICMP_HDR.unpack_from(packet)
+    total = (~old_checksum & 0xFFFF) + (~old_sequence & 0xFFFF) + sequence
+    while total >> 16:
+        total = (total >> 16) + (total & 0xFFFF)
+    _U16.pack_into(packet, 2, ~total & 0xFFFF)
+    _U16.pack_into(packet, 6, sequence)
+
+
+def format_rtt(rtt_us):
+    """
+            Formats a round-trip time using integer arithmetic only
+
+            Args:
+                rtt_us (int): The round-trip time in microseconds
+
+            Returns:
+                Str: The round-trip time in milliseconds with two decimals
+            """
+    return f"{rtt_us // 1000}.{rtt_us % 1000 // 10:02d}"
+
+
+def attach_reply_filter(sock, id):
+    """
+            Attaches a classic BPF program to sock so the kernel only delivers ICMP Echo Replies with
+            packet ID id, instead of waking us up for every ICMP packet on the host (Linux only)
+
+            Args:
+                sock (Socket): The raw ICMP socket
+                id (int): The packet ID to accept
 
             Returns:
-                Packet: A ICMP Echo Packet of ID id of size data_size
+                bool: True if the filter was attached, False if it is not supported here
             """
-    header = struct.pack('!BBHHH', 8, 0, 0, id, 1)
-    data = bytes([i % 256 for i in range(data_size)])  # More robust data generation
-    checksum_val = checksum(header + data)
-    header = struct.pack('!BBHHH', 8, 0, checksum_val, id, 1)
-    return header + data
+    if not sys.platform.startswith('linux'):
+        return False
+    program = [
+        (0xB1, 0, 0, 0),  # ldxb 4*([0]&0xf) -- X = IP header length
+        (0x50, 0, 0, 0),  # ldb [x+0] -- ICMP type
+        (0x15, 0, 3, 0),  # jeq #0 (Echo Reply), else drop
+        (0x48, 0, 0, 4),  # ldh [x+4] -- ICMP id
+        (0x15, 0, 1, id),  # jeq #id, else drop
+        (0x06, 0, 0, 0xFFFFFFFF),  # ret #-1 -- accept the whole packet
+        (0x06, 0, 0, 0),  # ret #0 -- drop
+    ]
+    filters = ctypes.create_string_buffer(b''.join(struct.pack('HBBI', *insn) for insn in program))
+    fprog = struct.pack('HP', len(program), ctypes.addressof(filters))  # struct sock_fprog
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, _SO_ATTACH_FILTER, fprog)
+    except OSError:
+        return False
+    return True
 
 
-def receive_ping(sock, id, timeout):
+def receive_ping(sock, sel, id, sequence, send_ns, timeout):
     """
                 Listens for pings on socket sock
 
                 Args:
                     sock (Socket): The socket to listen on
+                    sel (Selector): A selector with sock registered for reading
                     id (int): The packet ID
+                    sequence (int): The sequence number of the packet awaiting a reply
+                    send_ns (int): time.monotonic_ns() at which the packet was sent
                     timeout (int): Time in seconds to wait before timeing out
 
                 Returns:
                     Packet: The received packet or None if timed out
                 """
-    time_received = time.time()
-    while time.time() - time_received < timeout:
-        ready = select.select([sock], [], [], timeout - (time.time() - time_received))
-        if ready[0]:
-            packet, addr = sock.recvfrom(1024)
-            icmp_header = packet[20:28]
-            type, code, checksum, packet_id, sequence = struct.unpack('!BBHHH', icmp_header)
-            if type == 0 and packet_id == id:  # Check ICMP type for reply (0)
-                rtt = (time.time() - time_received) * 1000
-                return addr, rtt
+    buf = bytearray(1500)  # Reused for every reply instead of allocating a new bytes object per recv
+    deadline = time.monotonic_ns() + int(timeout * 1e9)
+    while True:
+        now = time.monotonic_ns()
+        if now >= deadline:
+            break
+        if sel.select((deadline - now) / 1e9):
+            n, addr = sock.recvfrom_into(buf)
+            if n < 28:
+                continue
+            # The ICMP checksum (RFC 792) is not re-summed in userspace; the id and sequence checks reject stray packets
+            type, code, _, packet_id, reply_sequence = _ICMP_HDR.unpack_from(buf, 20)
+            if type == 0 and packet_id == id and reply_sequence == sequence:  # Check ICMP type for reply (0)
+                rtt_us = (time.monotonic_ns() - send_ns) // 1000
+                return addr, rtt_us
     return None
 
 
@@ -91,6 +170,7 @@ def ping(host, count=4, interval=1, timeout=1, data_size=56):
     except PermissionError:
         print("You need to run this program as root (or use a different ping method).")
         return
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)  # Room for a burst of replies
 
     try:
         host_ip = socket.gethostbyname(host)
@@ -100,24 +180,37 @@ def ping(host, count=4, interval=1, timeout=1, data_size=56):
 
     print(f"PING {host} ({host_ip}): {count} packets of {data_size} bytes")
 
+    sel = selectors.DefaultSelector()  # epoll on Linux, registered once for the whole run
+    sel.register(sock, selectors.EVENT_READ)
+
     packet_id = random.randint(1, 65535)
+    attach_reply_filter(sock, packet_id)  # receive_ping still checks the id, in case this is unsupported
+    packet = create_packet(packet_id, data_size)  # Built once, only the sequence number changes per iteration
+    reply_bytes = len(packet) - 28
 
     for i in range(count):
-        packet = create_packet(packet_id, data_size)
+        sequence = (i + 1) & 0xFFFF
+        set_sequence(packet, sequence)
+        send_ns = time.monotonic_ns()
+        next_send_ns = send_ns + int(interval * 1e9)
         sock.sendto(packet, (host_ip, 0))  # Port 0 for ICMP
         print(f"Sent packet {i + 1}")
 
-        result = receive_ping(sock, packet_id, timeout)
+        result = receive_ping(sock, sel, packet_id, sequence, send_ns, timeout)
 
         if result is None:
             print(f"Request timeout for packet {i + 1}")
         else:
-            addr, rtt = result
-            print(f"Reply from {addr[0]}: bytes={len(packet) - 28} time={rtt:.2f}ms")
+            addr, rtt_us = result
+            print(f"Reply from {addr[0]}: bytes={reply_bytes} time={format_rtt(rtt_us)}ms")
 
-        time.sleep(interval)
+        # The interval counts from the send, so time spent waiting for the reply is not added on top
+        delay = (next_send_ns - time.monotonic_ns()) / 1e9
+        if delay > 0:
+            time.sleep(delay)
 
     print(f"Ping to {host} completed.")
+    sel.close()
     sock.close()
 
 
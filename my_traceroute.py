@@ -1,9 +1,15 @@
 import argparse
 import random
+import selectors
 import socket
 import struct
 import time
-import select
+from concurrent.futures import ThreadPoolExecutor
+
+_PAYLOAD_256 = bytes(range(256))
+_ICMP_HDR = struct.Struct('!BBHHH')  # type, code, checksum, id, sequence
+_U16 = struct.Struct('!H')
+_HOST_NAMES = {}  # Reverse DNS cache, ip -> host name (or None)
 
 
 def checksum(source_string):
@@ -11,80 +17,171 @@ def checksum(source_string):
             Generates a checksum for a given string (used for packet validation).
 
             Args:
-                source_string (bytes): The data for which the checksum is to be generated.
+                source_string (bytes-like): The data for which the checksum is to be generated (bytes, bytearray or memoryview).
 
             Returns:
                 int: The checksum value for the given data.
             """
-    count = len(source_string) % 2
-    sum = 0
-    for i in range(0, len(source_string) - count, 2):
-        sum += (source_string[i] << 8) + (source_string[i + 1])
-    if count:
-        sum += source_string[i + 1]
-    while sum >> 16:
-        sum = (sum >> 16) + (sum & 0xFFFF)
-    sum = ~sum & 0xFFFF
-    return sum
-
-
-def create_packet(id, data_size):
+    total = int.from_bytes(source_string, 'big')
+    if len(source_string) & 1:
+        total <<= 8  # Pad odd lengths with a zero byte
+    # 2**16 == 1 (mod 0xFFFF), so one modulo folds every 16-bit word and carry at once
+    if total:
+        total = (total - 1) % 0xFFFF + 1
+    return ~total & 0xFFFF
+
+
+def create_packet(id, data_size, sequence=1):
     """
                 Given packet_id and a desired packet size created a ICMP Echo packet
 
                 Args:
                     id (int): The packet ID / Number
                     data_size: The amount of bytes to pack into the packet
+                    sequence (int) (default 1): The ICMP sequence number
+
+                Returns:
+                    Packet: A ICMP Echo Packet of ID id of size data_size, as a mutable bytearray
+                """
+    packet = bytearray(8 + data_size)  # Header and data are written into this one buffer in place
+    _ICMP_HDR.pack_into(packet, 0, 8, 0, 0, id, sequence)
+    for offset in range(0, data_size, 256):  # Repeating 0x00..0xFF pattern
+        chunk = min(256, data_size - offset)
+        packet[8 + offset:8 + offset + chunk] = _PAYLOAD_256[:chunk]
+    _U16.pack_into(packet, 2, checksum(packet))
+    return packet
+
+
+def set_sequence(packet, sequence):
+    """
+                Rewrites the sequence number of an ICMP Echo packet in place, updating the checksum
+                incrementally (RFC 1624) instead of summing the whole packet again
+
+                Args:
+                    packet (bytearray): A packet built by create_packet
+                    sequence (int): The new ICMP sequence number
+
+                Returns:
+                    None
+                """
+    _, _, old_checksum, _, old_sequence = _ICMP_HDR.unpack_from(packet)
+    total = (~old_checksum & 0xFFFF) + (~old_sequence & 0xFFFF) + sequence
+    while total >> 16:
+        total = (total >> 16) + (total & 0xFFFF)
+    _U16.pack_into(packet, 2, ~total & 0xFFFF)
+    _U16.pack_into(packet, 6, sequence)
+
+
+def format_rtt(rtt_us):
+    """
+                Formats a round-trip time using integer arithmetic only
+
+                Args:
+                    rtt_us (int): The round-trip time in microseconds
+
+                Returns:
+                    Str: The round-trip time in milliseconds with two decimals
+                """
+    return f"{rtt_us // 1000}.{rtt_us % 1000 // 10:02d}"
+
+
+def lookup_host_name(ip):
+    """
+                Reverse resolves an IP address, caching the result
+
+                Args:
+                    ip (Str): The IP address to look up
 
                 Returns:
-                    Packet: A ICMP Echo Packet of ID id of size data_size
+                    Str: The host name, or None if the address does not resolve
                 """
-    header = struct.pack('!BBHHH', 8, 0, 0, id, 1)
-    data = bytes([i % 256 for i in range(data_size)])  # More robust data generation
-    checksum_val = checksum(header + data)
-    header = struct.pack('!BBHHH', 8, 0, checksum_val, id, 1)
-    return header + data
+    if ip not in _HOST_NAMES:
+        try:
+            _HOST_NAMES[ip] = socket.gethostbyaddr(ip)[0]
+        except (socket.herror, socket.gaierror):
+            _HOST_NAMES[ip] = None
+    return _HOST_NAMES[ip]
+
+
+def send_probe(sock, packet, host_ip, ttl):
+    """
+                Sends packet to host_ip with the given TTL, passing the TTL as IP_TTL ancillary data
+                so that setting it and sending take a single sendmsg() syscall
+
+                Args:
+                    sock (Socket): The socket to send on
+                    packet (bytearray): The ICMP packet to send
+                    host_ip (Str): The destination IP address
+                    ttl (int): Time to live for this probe
+
+                Returns:
+                    None
+                """
+    try:
+        sock.sendmsg([packet], [(socket.IPPROTO_IP, socket.IP_TTL, struct.pack('i', ttl))], 0, (host_ip, 0))
+    except (AttributeError, OSError):  # No sendmsg() (Windows) or no IP_TTL control message support
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_TTL, ttl)
+        sock.sendto(packet, (host_ip, 0))
 
 
-def receive_traceroute(sock, id, ttl, timeout):
+def receive_traceroute(sock, sel, id, send_times, timeout):
     """
-                    Listens for pings on socket sock
+                    Listens for the replies to a batch of traceroute probes on socket sock
 
                     Args:
                         sock (Socket): The socket to listen on
+                        sel (Selector): A selector with sock registered for reading
                         id (int): The packet ID
+                        send_times (dict): time.monotonic_ns() send time of each probe, keyed by its TTL (which is also its sequence number)
                         timeout (int): Time in seconds to wait before timeing out
-                        ttl (int): Time to live [Unused, can be used to adjust starting ttl]
 
                     Returns:
-                        Packet: The received packet or None if timed out
+                        dict: (addr, rtt_us, reached) for every TTL that was answered
                     """
-    time_received = time.time()
-    while time.time() - time_received < timeout:
-        ready = select.select([sock], [], [], timeout - (time.time() - time_received))
-        if ready[0]:
-            packet, addr = sock.recvfrom(1024)
-            ip_header = packet[:20]  # First 20 bytes are the IP header
-            icmp_header = packet[20:28]  # ICMP header starts at byte 20
-
-            # Unpack the ICMP header
-            type, code, checksum, packet_id, sequence = struct.unpack('!BBHHH', icmp_header)
+    replies = {}
+    reached_ttl = None
+    buf = bytearray(1500)  # Reused for every reply instead of allocating a new bytes object per recv
+    deadline = time.monotonic_ns() + int(timeout * 1e9)
+    while True:
+        now = time.monotonic_ns()
+        if now >= deadline:
+            break
+        if sel.select((deadline - now) / 1e9):
+            n, addr = sock.recvfrom_into(buf)
+            if n < 28:
+                continue
+
+            # Unpack the ICMP header, which starts at byte 20. Its checksum (RFC 792) is not
+            # re-summed in userspace; the id and sequence checks below reject stray packets
+            type, code, _, packet_id, sequence = _ICMP_HDR.unpack_from(buf, 20)
+
+            if type == 11:  # Time Exceeded embeds our original IP + ICMP headers after its own header
+                if n < 56:
+                    continue
+                _, _, _, packet_id, sequence = _ICMP_HDR.unpack_from(buf, 48)
 
             # Ensure we only process packets with the correct packet_id
-            if packet_id != id or packet_id == id:
+            if packet_id == id:
+                if sequence not in send_times or sequence in replies:
+                    continue
+                rtt_us = (time.monotonic_ns() - send_times[sequence]) // 1000
                 if type == 0:  # ICMP Echo Reply (Destination Reached)
-                    rtt = (time.time() - time_received) * 1000
-                    return addr, rtt, True
+                    replies[sequence] = addr, rtt_us, True
+                    if reached_ttl is None or sequence < reached_ttl:
+                        reached_ttl = sequence
                 elif type == 11:  # ICMP Time Exceeded (Intermediate hop)
-                    rtt = (time.time() - time_received) * 1000
-                    return addr, rtt, False
-    return None, None, False
+                    replies[sequence] = addr, rtt_us, False
+
+            # Done once every hop up to the destination has answered
+            if reached_ttl is not None and all(ttl in replies for ttl in range(1, reached_ttl + 1)):
+                break
+    return replies
 
 
 def traceroute(host, print_num, print_summary, count=1):
     """
-                    Pings a given host address, incrementing TTL each time and printing all intermediate responses
-                    that sent the packet back due to expired TTL
+                    Pings a given host address with one probe per TTL, sent all at once, and prints all intermediate
+                    responses that sent the packet back due to expired TTL
 
                     Args:
                     host (Str): The ip address or hostname to ping count (int) (default 4): Amount of packets
@@ -99,13 +196,14 @@ def traceroute(host, print_num, print_summary, count=1):
     max_hops = 30
     timeout = 5
     data_size = 56
-    timeout_count = {ttl: 0 for ttl in range(1, max_hops + 1)}
+    timeout_count = [0] * (max_hops + 1)  # Indexed by TTL, slot 0 unused
 
     try:
         sock = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP)
     except PermissionError:
         print("You need to run this program as root (or use a different traceroute method).")
         return
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)  # Room for a burst of replies
 
     try:
         host_ip = socket.gethostbyname(host)
@@ -115,42 +213,48 @@ def traceroute(host, print_num, print_summary, count=1):
 
     print(f"Traceroute to {host} ({host_ip}), {max_hops} hops max:")
 
+    sel = selectors.DefaultSelector()  # epoll on Linux, registered once for the whole run
+    sel.register(sock, selectors.EVENT_READ)
+
     packet_id = random.randint(1, 65535)
+    packet = create_packet(packet_id, data_size)  # Built once, only the sequence number changes per probe
+
+    # Fire every probe up front, each carrying its TTL as the sequence number, then collect the replies together
+    send_times = {}
     for ttl in range(1, max_hops + 1):
-        sock.setsockopt(socket.IPPROTO_IP, socket.IP_TTL, ttl)
-        packet = create_packet(packet_id, data_size)
-        sock.sendto(packet, (host_ip, 0))
+        set_sequence(packet, ttl)
+        send_times[ttl] = time.monotonic_ns()
+        send_probe(sock, packet, host_ip, ttl)
 
-        print(f"{ttl:2}...", end=" ")
-        addr, rtt, reached = receive_traceroute(sock, packet_id, ttl, timeout)
+    replies = receive_traceroute(sock, sel, packet_id, send_times, timeout)
 
-        if addr:
-            if print_num:
-                print(f"{addr[0]}: time={rtt:.2f}ms", end=" ")
-            else:
-                try:
-                    host_name = socket.gethostbyaddr(addr[0])[0]
-                    print(f"{host_name} ({addr[0]}): time={rtt:.2f}ms", end=" ")
-                except socket.herror:
-                    print(f"{addr[0]}: time={rtt:.2f}ms", end=" ")
+    if not print_num:
+        # Resolve every hop concurrently so slow reverse DNS costs one lookup time rather than one per hop
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(lookup_host_name, {addr[0] for addr, rtt_us, reached in replies.values()}))
+
+    for ttl in range(1, max_hops + 1):
+        addr, rtt_us, reached = replies.get(ttl, (None, None, False))
 
+        # Each hop is written with a single print so the line comes out in one write
+        if addr:
+            host_name = None if print_num else lookup_host_name(addr[0])
+            hop = f"{host_name} ({addr[0]})" if host_name else addr[0]
+            status = "Destination reached." if reached else "Time Exceeded."
+            print(f"{ttl:2}... {hop}: time={format_rtt(rtt_us)}ms {status}")
             if reached:
-                print("Destination reached.")
                 break
-            else:
-                print("Time Exceeded.")
         else:
-            print("Request Timed Out")
+            print(f"{ttl:2}... Request Timed Out")
             timeout_count[ttl] += 1
 
-        time.sleep(1)
-
     if print_summary:
         print("\nSummary of probes not answered:")
-        for ttl in range(1, max_hops + 1):
-            if timeout_count[ttl] > 0:
-                print(f"Hop {ttl}: {timeout_count[ttl]} probe(s) not answered.")
+        for ttl, missed in enumerate(timeout_count[1:], 1):
+            if missed:
+                print(f"Hop {ttl}: {missed} probe(s) not answered.")
 
+    sel.close()
     sock.close()
 
 